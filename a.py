@@ -1,4 +1,5 @@
-from app import app, db
+from sqlalchemy import inspect, text
+from app import app, db, Clip, get_embed_url
 
 def create_tables():
     with app.app_context():
@@ -6,5 +7,29 @@ def create_tables():
         db.create_all()
         print("Tabelas criadas com sucesso!")
 
+def create_indexes():
+    with app.app_context():
+        print("A criar índices em falta...")
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+        print("Índices criados com sucesso!")
+
+def backfill_embed_urls():
+    with app.app_context():
+        print("A preencher embed_url dos clipes existentes...")
+        columns = [column['name'] for column in inspect(db.engine).get_columns('clips')]
+        if 'embed_url' not in columns:
+            with db.engine.begin() as connection:
+                connection.execute(text('ALTER TABLE clips ADD COLUMN embed_url VARCHAR(255)'))
+
+        clips = Clip.query.filter(Clip.embed_url.is_(None)).all()
+        for clip in clips:
+            clip.embed_url = get_embed_url(clip.video_url)
+        db.session.commit()
+        print(f"{len(clips)} clipes atualizados!")
+
 if __name__ == '__main__':
-    create_tables()
\ No newline at end of file
+    create_tables()
+    create_indexes()
+    backfill_embed_urls()
\ No newline at end of file
@@ -1,17 +1,26 @@
 import os
 import secrets
 import re
+import asyncio
+import aiohttp
+import orjson
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from flask import Flask, render_template, request, redirect, url_for, g, session, flash
+from flask import Flask, render_template, stream_template, request, redirect, url_for, g, session, flash
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import joinedload
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, PasswordField, SubmitField, TextAreaField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Length, URL
 from flask_bcrypt import Bcrypt
+from flask_caching import Cache
 from datetime import datetime
 
 
@@ -26,6 +35,7 @@ STEAM_API_KEY = os.getenv("STEAM_API_KEY")
 FACEIT_API_KEY = os.getenv("FACEIT_API_KEY")
 DATABASE_URL = os.getenv("DATABASE_URL")
 SECRET_KEY = os.getenv("SECRET_KEY")
+REDIS_URL = os.getenv("REDIS_URL")
 
 missing_envs = [k for k, v in {
     "STEAM_API_KEY": STEAM_API_KEY,
@@ -44,8 +54,22 @@ if missing_envs:
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_pre_ping': True,
+    'pool_size': 10,
+    'max_overflow': 20
+}
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_ROUNDS', 12))
+
+if REDIS_URL:
+    app.config['CACHE_TYPE'] = 'RedisCache'
+    app.config['CACHE_REDIS_URL'] = REDIS_URL
+else:
+    app.config['CACHE_TYPE'] = 'SimpleCache'
+app.config['CACHE_DEFAULT_TIMEOUT'] = 60
 
 db = SQLAlchemy(app)
+cache = Cache(app)
 bcrypt = Bcrypt(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
@@ -81,15 +105,16 @@ class Clip(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     video_url = db.Column(db.String(255), nullable=False)
-    date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    embed_url = db.Column(db.String(255), nullable=True)
+    date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
 
     def __repr__(self):
         return f'<Clip {self.title}>'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
 
 
 class RegistrationForm(FlaskForm):
@@ -151,18 +176,20 @@ def save_picture(form_picture):
 
     return picture_fn
 
+YOUTUBE_REGEX = re.compile(
+    r'(https?://)?(www\.)?(youtube\.com/watch\?v=|youtu\.be/|youtube\.com/shorts/)([A-Za-z0-9_-]{11})'
+)
+
+@lru_cache(maxsize=2048)
 def get_embed_url(video_url):
-    youtube_regex = re.compile(
-        r'(https?://)?(www\.)?(youtube\.com/watch\?v=|youtu\.be/|youtube\.com/shorts/)([A-Za-z0-9_-]{11})'
-    )
-    match = youtube_regex.search(video_url)
+    match = YOUTUBE_REGEX.search(video_url)
     if match:
         return f"https://www.youtube.com/embed/{match.group(4)}"
     return None
 
-@app.context_processor
-def utility_processor():
-    return dict(get_embed_url=get_embed_url)
+@app.template_filter('embed')
+def embed_filter(video_url):
+    return get_embed_url(video_url)
 
 
 STEAM_API_BASE_URL = "http://api.steampowered.com"
@@ -171,29 +198,57 @@ GET_PLAYER_SUMMARIES = f"{STEAM_API_BASE_URL}/ISteamUser/GetPlayerSummaries/v000
 GET_USER_STATS = f"{STEAM_API_BASE_URL}/ISteamUserStats/GetUserStatsForGame/v0002/"
 GET_OWNED_GAMES = f"{STEAM_API_BASE_URL}/IPlayerService/GetOwnedGames/v0001/"
 CS2_APP_ID = 730
+STEAMID64_BASE = 76561197960265728
 
 FACEIT_API_BASE_URL = "https://open.faceit.com/data/v4"
 
+class UpstreamRetry(Retry):
+    # Se a API pedir para esperar (Retry-After), desiste em vez de tentar de novo antes da hora.
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if has_retry_after:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+HTTP_RETRY = UpstreamRetry(
+    total=2,
+    backoff_factor=0.2,
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=('GET',),
+    raise_on_status=False
+)
+
+HTTP = requests.Session()
+HTTP.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=HTTP_RETRY))
+HTTP.mount('http://', HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=HTTP_RETRY))
+
+PROFILE_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv('GUNICORN_THREADS', 8)) * 4)
+
+
+@cache.memoize(timeout=3600, response_filter=lambda steam_id: steam_id is not None)
+def _resolve_vanity(identifier):
+    params = {'key': STEAM_API_KEY, 'vanityurl': identifier}
+    response = HTTP.get(RESOLVE_VANITY_URL, params=params, timeout=5)
+    data = orjson.loads(response.content)
+
+    if data['response']['success'] == 1:
+        return data['response']['steamid']
+    return None
 
 def get_steam_id64(input_query):
     identifier = input_query.strip("/").split("/")[-1]
     
     if identifier.isdigit() and len(identifier) == 17:
-        return identifier 
+        if STEAMID64_BASE < int(identifier) < STEAMID64_BASE + 2**32:
+            return identifier
+        return None
 
-    params = {'key': STEAM_API_KEY, 'vanityurl': identifier}
     try:
-        response = requests.get(RESOLVE_VANITY_URL, params=params, timeout=5)
-        data = response.json()
-        
-        if data['response']['success'] == 1:
-            return data['response']['steamid']
-        else:
-            return None
+        return _resolve_vanity(identifier)
     except Exception as e:
         print(f"Erro ao resolver URL: {e}")
         return None
 
+@cache.memoize(timeout=60, response_filter=lambda data: 'error' not in data)
 def get_player_data(steam_id64):
     if not steam_id64:
         return {'error': 'ID da Steam não encontrado.'}
@@ -201,22 +256,27 @@ def get_player_data(steam_id64):
     player_data = {}
     try:
         params_summary = {'key': STEAM_API_KEY, 'steamids': steam_id64}
-        resp_summary = requests.get(GET_PLAYER_SUMMARIES, params=params_summary, timeout=5).json()
+        params_games = {'key': STEAM_API_KEY, 'steamid': steam_id64, 'format': 'json', 'include_played_free_games': 1}
+        params_stats = {'key': STEAM_API_KEY, 'steamid': steam_id64, 'appid': CS2_APP_ID}
+
+        f_summary = PROFILE_EXECUTOR.submit(HTTP.get, GET_PLAYER_SUMMARIES, params=params_summary, timeout=5)
+        f_games = PROFILE_EXECUTOR.submit(HTTP.get, GET_OWNED_GAMES, params=params_games, timeout=5)
+        f_stats = PROFILE_EXECUTOR.submit(HTTP.get, GET_USER_STATS, params=params_stats, timeout=5)
+
+        resp_summary = orjson.loads(f_summary.result().content)
         if not resp_summary['response']['players']:
             return {'error': 'Jogador não encontrado com este SteamID.'}
         player_data['profile'] = resp_summary['response']['players'][0]
 
-        params_games = {'key': STEAM_API_KEY, 'steamid': steam_id64, 'format': 'json', 'include_played_free_games': 1}
-        resp_games = requests.get(GET_OWNED_GAMES, params=params_games, timeout=5).json()
+        resp_games = orjson.loads(f_games.result().content)
         player_data['playtime_cs2_hours'] = 0
         if 'response' in resp_games and 'games' in resp_games['response']:
             for game in resp_games['response']['games']:
                 if game['appid'] == CS2_APP_ID:
                     player_data['playtime_cs2_hours'] = round(game['playtime_forever'] / 60)
                     break
-        
-        params_stats = {'key': STEAM_API_KEY, 'steamid': steam_id64, 'appid': CS2_APP_ID}
-        resp_stats = requests.get(GET_USER_STATS, params=params_stats, timeout=5).json()
+
+        resp_stats = orjson.loads(f_stats.result().content)
         
         stats_dict = {}
         if 'playerstats' in resp_stats and 'stats' in resp_stats['playerstats']:
@@ -234,18 +294,76 @@ def get_player_data(steam_id64):
     return player_data
 
 
+_EMPTY = {}
+
+def merge_faceit_match_stats(match, stats_data, player_id):
+    rounds = stats_data.get('rounds') or (_EMPTY,)
+    round0 = rounds[0]
+    players_by_id = {
+        player['player_id']: player
+        for team in round0.get('teams', ())
+        for player in team.get('players', ())
+        if 'player_id' in player
+    }
+
+    player = players_by_id.get(player_id)
+    if player:
+        player_stats = player.get('player_stats') or _EMPTY
+        round_stats = round0.get('round_stats', _EMPTY)
+        match['stats'] = {
+            'result': 'Venceu' if player_stats.get('Result') == '1' else 'Perdeu',
+            'score': round_stats.get('Score', 'N/A'),
+            'map': round_stats.get('Map', 'N/A'),
+            'kills': player_stats.get('Kills', '0'),
+            'deaths': player_stats.get('Deaths', '0'),
+            'assists': player_stats.get('Assists', '0')
+        }
+
+    return match
+
+async def fetch_faceit_match_stats(match_list, player_id, headers):
+    connector = aiohttp.TCPConnector(limit=20)
+    timeout = aiohttp.ClientTimeout(total=5)
+    async with aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout) as http_session:
+
+        async def fetch_match(match):
+            match_id = match['match_id']
+            url_match_stats = f"{FACEIT_API_BASE_URL}/matches/{match_id}/stats"
+            try:
+                async with http_session.get(url_match_stats) as resp_match_stats:
+                    if resp_match_stats.status != 200:
+                        return match, resp_match_stats.status == 404
+                    stats_data = orjson.loads(await resp_match_stats.read())
+                return merge_faceit_match_stats(match, stats_data, player_id), True
+            except Exception as e:
+                print(f"Erro ao buscar estatísticas da partida {match_id} (FACEIT): {e}")
+                return match, False
+
+        tasks = [asyncio.create_task(fetch_match(match)) for match in match_list if match.get('match_id')]
+
+        detailed_match_list = []
+        complete = True
+        for task in tasks:
+            match, match_complete = await task
+            detailed_match_list.append(match)
+            complete = complete and match_complete
+
+    return detailed_match_list, complete
+
+
+@cache.memoize(timeout=60, response_filter=lambda data: data is not None and not data.get('partial'))
 def get_faceit_data(steam_id64):
     headers = {'Authorization': f'Bearer {FACEIT_API_KEY}', 'accept': 'application/json'}
     faceit_data = {}
 
     try:
         url_search = f"{FACEIT_API_BASE_URL}/players?game=cs2&game_player_id={steam_id64}"
-        resp_search = requests.get(url_search, headers=headers, timeout=5) 
+        resp_search = HTTP.get(url_search, headers=headers, timeout=5) 
         
         if resp_search.status_code != 200:
             return None
         
-        player_info = resp_search.json()
+        player_info = orjson.loads(resp_search.content)
         player_id = player_info.get('player_id') 
         
         if not player_id:
@@ -254,59 +372,27 @@ def get_faceit_data(steam_id64):
         faceit_data['profile'] = player_info
 
         url_stats = f"{FACEIT_API_BASE_URL}/players/{player_id}/stats/cs2"
-        resp_stats = requests.get(url_stats, headers=headers, timeout=5)
+        resp_stats = HTTP.get(url_stats, headers=headers, timeout=5)
         
         if resp_stats.status_code == 200:
-            faceit_data['stats'] = resp_stats.json().get('lifetime', {})
+            faceit_data['stats'] = orjson.loads(resp_stats.content).get('lifetime', {})
         else:
             faceit_data['stats'] = {} 
+            faceit_data['partial'] = resp_stats.status_code != 404
             
         url_history = f"{FACEIT_API_BASE_URL}/players/{player_id}/history?game=cs2&offset=0&limit=10"
-        resp_history = requests.get(url_history, headers=headers, timeout=5)
+        resp_history = HTTP.get(url_history, headers=headers, timeout=5)
         
         if resp_history.status_code != 200:
             faceit_data['history'] = []
+            faceit_data['partial'] = faceit_data.get('partial') or resp_history.status_code != 404
             return faceit_data
 
-        match_list = resp_history.json().get('items', [])
-        detailed_match_list = []
-
-        for match in match_list:
-            match_id = match.get('match_id')
-            if not match_id:
-                continue
-
-            url_match_stats = f"{FACEIT_API_BASE_URL}/matches/{match_id}/stats"
-            resp_match_stats = requests.get(url_match_stats, headers=headers, timeout=5)
-            
-            if resp_match_stats.status_code != 200:
-                detailed_match_list.append(match) 
-                continue
-
-            stats_data = resp_match_stats.json()
-            found_player_stats = False
-            
-            for team in stats_data.get('rounds', [{}])[0].get('teams', []):
-                for player in team.get('players', []):
-                    if player.get('player_id') == player_id:
-                        player_stats = player.get('player_stats', {})
-                        round_stats = stats_data.get('rounds', [{}])[0].get('round_stats', {})
-                        match['stats'] = {
-                            'result': 'Venceu' if player_stats.get('Result') == '1' else 'Perdeu',
-                            'score': round_stats.get('Score', 'N/A'),
-                            'map': round_stats.get('Map', 'N/A'),
-                            'kills': player_stats.get('Kills', '0'),
-                            'deaths': player_stats.get('Deaths', '0'),
-                            'assists': player_stats.get('Assists', '0')
-                        }
-                        found_player_stats = True
-                        break
-                if found_player_stats:
-                    break
-            
-            detailed_match_list.append(match)
+        match_list = orjson.loads(resp_history.content).get('items', [])
+        detailed_match_list, history_complete = asyncio.run(fetch_faceit_match_stats(match_list, player_id, headers))
 
         faceit_data['history'] = detailed_match_list
+        faceit_data['partial'] = faceit_data.get('partial') or not history_complete
 
     except Exception as e:
         print(f"Erro ao buscar dados do jogador (FACEIT): {e}")
@@ -315,9 +401,15 @@ def get_faceit_data(steam_id64):
     return faceit_data
 
 
+CLIPS_PER_PAGE = 20
+
 @app.route('/')
+@cache.cached(timeout=30, query_string=True, unless=lambda: current_user.is_authenticated)
 def index():
-    clips = Clip.query.order_by(Clip.date_posted.desc()).all()
+    page = request.args.get('page', 1, type=int)
+    clips = Clip.query.options(joinedload(Clip.author)).order_by(Clip.date_posted.desc()).paginate(
+        page=page, per_page=CLIPS_PER_PAGE, error_out=False
+    )
     return render_template('index.html', clips=clips)
 
 @app.route('/search')
@@ -335,13 +427,13 @@ def search():
 
 @app.route('/perfil/<steam_id64>')
 def perfil_page(steam_id64):
+    faceit_future = PROFILE_EXECUTOR.submit(get_faceit_data, steam_id64)
+
     data = get_player_data(steam_id64)
     if 'error' in data:
         return f"Erro: {data['error']}"
     
-    data['faceit'] = get_faceit_data(steam_id64)
-    
-    return render_template('perfil.html', data=data)
+    return stream_template('perfil.html', data=data, faceit_result=faceit_future.result)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -408,7 +500,12 @@ def user_profile(username):
 def post_clip():
     form = ClipForm()
     if form.validate_on_submit():
-        clip = Clip(title=form.title.data, video_url=form.video_url.data, author=current_user)
+        clip = Clip(
+            title=form.title.data,
+            video_url=form.video_url.data,
+            embed_url=get_embed_url(form.video_url.data),
+            author=current_user
+        )
         db.session.add(clip)
         db.session.commit()
         flash('Seu clipe foi postado com sucesso!', 'success')
@@ -417,6 +514,5 @@ def post_clip():
 
 
 if __name__ == '__main__':
-    os.environ['FLASK_ENV'] = 'development'
-    app.run(debug=True)
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1')
 
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_class = 'gthread'
+
+timeout = 30
+keepalive = 30
+
+
+def on_starting(server):
+    # Aplica as alterações de esquema (tabelas, índices, embed_url) antes de subir os workers.
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'a.py')], check=True)